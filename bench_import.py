@@ -0,0 +1,93 @@
+#!/bin/python3
+"""Benchmark 'import posh' and check it stays lazy.
+
+Each run imports posh in a fresh interpreter and fails if it pulled in
+one of the modules posh defers, or built the global shell early.
+
+The time check compares against an eager import, done in the same way:
+posh plus every deferred module plus sh, as posh used to do at import.
+The lazy median has to stay under --max-ratio of the eager median, so a
+revert to eager imports fails however fast the machine is.
+
+    python3 bench_import.py [--runs N] [--max-ratio R] [--max-ms MS]
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+DEFERRED = ['subprocess', 'shutil', 'fcntl', 'pathlib', 'select', 'json', 'csv']
+
+# json is only imported after the measurement, so it can be caught too
+CHILD = """
+import sys, time
+before = set(sys.modules)
+start = time.perf_counter()
+import posh
+if EAGER:
+    for name in DEFERRED:
+        __import__(name)
+    posh.sh
+elapsed = time.perf_counter() - start
+loaded = sorted(set(sys.modules) - before)
+sh_built = 'sh' in vars(posh.posh)
+import json
+print(json.dumps({'ms': elapsed * 1000, 'loaded': loaded, 'sh_built': sh_built}))
+"""
+
+def run_once(eager: bool=False) -> dict:
+    root = str(Path(__file__).resolve().parent)
+    code = f"EAGER = {eager}\nDEFERRED = {DEFERRED}\n" + CHILD
+    output = subprocess.run([sys.executable, '-c', code], cwd=root,
+                            capture_output=True, check=True, text=True)
+    return json.loads(output.stdout)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=30)
+    parser.add_argument('--max-ratio', type=float, default=0.75,
+                        help='fail if the median import is slower than this '
+                             'fraction of the eager median')
+    parser.add_argument('--max-ms', type=float, default=None,
+                        help='also fail if the median import is slower')
+    args = parser.parse_args()
+
+    # Interleave the runs so both see the same machine load
+    results = []
+    eager_times = []
+    for _ in range(args.runs):
+        results.append(run_once())
+        eager_times.append(run_once(eager=True)['ms'])
+    times = sorted(result['ms'] for result in results)
+    median = statistics.median(times)
+    eager_median = statistics.median(eager_times)
+    print(f"import posh: median {median:.2f}ms  "
+          f"min {times[0]:.2f}ms  max {times[-1]:.2f}ms  ({args.runs} runs)")
+    print(f"eager import: median {eager_median:.2f}ms  "
+          f"ratio {median / eager_median:.2f}")
+
+    failed = False
+    eager = sorted({name for result in results for name in result['loaded']
+                    if name in DEFERRED})
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if any(result['sh_built'] for result in results):
+        print("FAIL: sh was built at import time")
+        failed = True
+    if median > eager_median * args.max_ratio:
+        print(f"FAIL: median over {args.max_ratio} of the eager import")
+        failed = True
+    if args.max_ms is not None and median > args.max_ms:
+        print(f"FAIL: median over {args.max_ms}ms budget")
+        failed = True
+
+    if failed:
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
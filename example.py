@@ -90,6 +90,38 @@ assert a.status() == 'running'
 a.wait()
 assert len(a.var().splitlines()) == 10
 
+#### sh.var(parse='lines').a()
+#Run a command named `a` and return it's stdout parsed into a list of records
+#while it runs.
+assert sh.var(parse='lines').printf('a\r\nb\nc') == ['a', 'b', 'c']
+assert sh.var(parse='split0').printf('a\\0b c\\0') == ['a', 'b c']
+assert sh.var(parse='jsonl').printf('{"a": 1}\n\n[2]\n') == [{'a': 1}, [2]]
+assert sh.var(parse='csv').printf('a,"b\nc"\n1,2\n') == [['a', 'b\nc'], ['1', '2']]
+assert sh.var(parse='tsv').printf('a\tb c\n') == [['a', 'b c']]
+assert sh.pipe().var(parse='lines').seq(5).tail('-n', 2).end() == ['4', '5']
+
+# Parse a background job's stdout lazily
+job = sh.var(parse='lines').bg().seq(3)
+assert list(job.records()) == ['1', '2', '3']
+job.wait()
+
+try:
+    sh.var(parse='yaml')
+    assert False
+except posh.PoshError:
+    pass
+
+# stderr can be a var alongside parsed stdout, and var() keeps the parse mode
+out, err = sh.var(parse='lines').var(posh.Files.STDERR).sh('-c', 'echo a; echo b >&2')
+assert out == ['a'] and err == 'b\n'
+
+# parse needs stdout to be a var
+try:
+    sh.var(posh.Files.STDERR, parse='lines')
+    assert False
+except posh.PoshError:
+    pass
+
 ### builtins
 ##### cd
 #Change current working dir.
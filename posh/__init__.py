@@ -1,5 +1,8 @@
-from .posh import sh
 from .posh import Files
+
+__all__ = ['sh', 'Files', 'PIPE', 'VAR', 'NULL', 'DEFAULT',
+           'STDIN', 'STDOUT', 'STDERR']
+
 PIPE = Files.PIPE
 VAR = Files.VAR
 NULL = Files.NULL
@@ -7,3 +10,10 @@ DEFAULT = Files.DEFAULT
 STDIN = Files.STDIN
 STDOUT = Files.STDOUT
 STDERR = Files.STDERR
+
+def __getattr__(name: str):
+    """Forward sh to posh.posh, which creates it lazily."""
+    if name == 'sh':
+        from .posh import sh
+        return sh
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,18 +1,23 @@
 #TODO Stretch goal. Make Job generic. Make sh that can run Popen jobs as well as
 #       run jobs in a process (this would allow control via ssh)
+from __future__ import annotations
 import sys
 import os
-import shutil
-import fcntl
-import subprocess
 import enum
 from typing import IO
 from typing import cast
 from typing import Callable
-from subprocess import Popen
-from pathlib import Path, PurePath
+from typing import TYPE_CHECKING
+from collections.abc import Iterable
+from collections.abc import Mapping
+from collections.abc import MutableMapping
 from functools import partial
 
+# subprocess, shutil, fcntl, pathlib etc. are imported where they are used
+# so that 'import posh' stays cheap for short lived scripts.
+if TYPE_CHECKING:
+    from pathlib import Path
+
 class PoshError(Exception):
     """Error caught by Posh."""
 
@@ -29,7 +34,89 @@ class Files(enum.Enum):
     STDOUT = enum.auto()
     STDERR = enum.auto()
 
-FileInputType = (int | IO | Files | str | Path)
+FileInputType = (int | IO | Files | str | os.PathLike)
+
+def _read_chunks(file: IO, drain: IO | None=None,
+                 drained: list[bytes] | None=None):
+    """Yield chunks of file as they arrive, until EOF.
+
+    If drain is given, it's read into drained alongside file, until
+    both hit EOF, so the process can't block on a full drain pipe
+    while we wait on file. Reads go through the file objects, so
+    anything already in their buffers isn't lost.
+    """
+    import select
+
+    readers = [file] if drain is None else [file, drain]
+
+    # select can't see what's already buffered, so take that first.
+    # Non-blocking reads return b'' when there's nothing to read yet.
+    ready = list(readers)
+    eof_on_empty = False
+    while readers:
+        for reader in ready:
+            chunk = reader.read1(65536)
+            if not chunk:
+                # Only b'' once select says it's readable means EOF
+                if eof_on_empty:
+                    readers.remove(reader)
+            elif reader is file:
+                yield chunk
+            else:
+                cast(list, drained).append(chunk)
+        if readers:
+            ready, _, _ = select.select(readers, [], [])
+            eof_on_empty = True
+
+def _split_records(chunks: Iterable[bytes], sep: bytes, keepends: bool=False):
+    """Yield sep-delimited byte records from chunks as they arrive.
+
+    Only the current partial record is kept, not the whole output,
+    and each chunk is scanned for sep once.
+    """
+    pending: list[bytes] = []
+    for chunk in chunks:
+        pieces = chunk.split(sep)
+        if len(pieces) == 1:
+            pending.append(chunk)
+            continue
+        pending.append(pieces[0])
+        pieces[0] = b''.join(pending)
+        pending = [pieces.pop()]
+        for record in pieces:
+            yield record + sep if keepends else record
+    if any(pending):
+        yield b''.join(pending)
+
+def _parse_lines(chunks: Iterable[bytes]):
+    for line in _split_records(chunks, b'\n'):
+        yield line.rstrip(b'\r').decode()
+
+def _parse_split0(chunks: Iterable[bytes]):
+    for record in _split_records(chunks, b'\0'):
+        yield record.decode()
+
+def _parse_jsonl(chunks: Iterable[bytes]):
+    import json
+
+    for line in _split_records(chunks, b'\n'):
+        if line.strip():
+            yield json.loads(line)
+
+def _parse_csv(chunks: Iterable[bytes], delimiter: str=','):
+    import csv
+
+    # Keep line endings so csv can handle quoted fields with newlines
+    lines = (line.decode() for line in _split_records(chunks, b'\n', keepends=True))
+    yield from csv.reader(lines, delimiter=delimiter)
+
+PARSERS: dict[str, Callable] = {
+    'lines': _parse_lines,
+    'split0': _parse_split0,
+    'jsonl': _parse_jsonl,
+    'csv': _parse_csv,
+    'tsv': partial(_parse_csv, delimiter='\t'),
+}
 
 class Job:
     """A Job is a wrapper around a Popen."""
@@ -38,9 +125,11 @@ class Job:
                  path: str | Path,
                  *args: str,
                  shell: bool=False,
-                 env: dict = dict(os.environ),
+                 env: MutableMapping | None = None,
                  cwd: str | Path = ''):
         """Initialize a Job."""
+        if env is None:
+            env = os.environ
         self.path = path
         self.args = args
         self.env = env
@@ -48,6 +137,15 @@ class Job:
         self.shell = shell
         self.cwd = cwd or env.get('PWD', '/')
 
+        # Name of a PARSERS entry used to parse a VAR stdout
+        self.parse: str | None = None
+
+        # stderr read while records() was waiting on stdout
+        self._err_chunks: list[bytes] = []
+
+        # Job in a pipe whose stdout/stderr feeds our stdin
+        self.upstream: Job | None = None
+
         # Default files. Use stdxxx.buffer for byte buffers
         self.stdin: FileInputType = sys.stdin
         self.stdout: FileInputType = sys.stdout.buffer
@@ -55,8 +153,10 @@ class Job:
 
     def _resolve_file(self, file: FileInputType, mode: str='ab') -> int | IO:
         """Translate normalized user input to what Popen expects."""
+        import subprocess
+
         # Assume str is a Path. Open Paths.
-        if isinstance(file, (str, PurePath)):
+        if isinstance(file, (str, os.PathLike)):
             return open(file, mode)
 
         # Translate enums
@@ -87,6 +187,8 @@ class Job:
 
     @staticmethod
     def _make_non_blocking(file: IO) -> None:
+        import fcntl
+
         fd = file.fileno()
         fl = fcntl.fcntl(fd, fcntl.F_GETFL)
         fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
@@ -94,13 +196,17 @@ class Job:
     def _handle_files_post_start(self, stdin, stdout, stderr) -> None:
         """Handle files we opened."""
         # Close files we opened just to pass to Popen
-        if isinstance(self.stdin, (str, PurePath)):
+        if isinstance(self.stdin, (str, os.PathLike)):
             stdin.close()
-        if isinstance(self.stdout, (str, PurePath)):
+        if isinstance(self.stdout, (str, os.PathLike)):
             stdout.close()
-        if isinstance(self.stderr, (str, PurePath)):
+        if isinstance(self.stderr, (str, os.PathLike)):
             stderr.close()
 
+        # The child has its own copy of the upstream pipe now
+        if self.upstream is not None and stdin in self.upstream.get_fds():
+            stdin.close()
+
         if self.stdout == Files.VAR and self.proc and self.proc.stdout:
             self._make_non_blocking(self.proc.stdout)
         if self.stderr == Files.VAR and self.proc and self.proc.stderr:
@@ -122,18 +228,20 @@ class Job:
         else:
             cmd = [str(self.path)]+list(self.args)
 
-        # Run the process
-        self.proc = Popen(
-                cmd,
-                cwd=self.cwd,
-                env=self.env,
-                shell=self.shell,
-                stdout=stdout,
-                stderr=stderr,
-                stdin=stdin)
-
-        # Close files based off paths
-        self._handle_files_post_start(stdin, stdout, stderr)
+        from subprocess import Popen
+
+        # Run the process. Close files based off paths even if it fails
+        try:
+            self.proc = Popen(
+                    cmd,
+                    cwd=self.cwd,
+                    env=self.env,
+                    shell=self.shell,
+                    stdout=stdout,
+                    stderr=stderr,
+                    stdin=stdin)
+        finally:
+            self._handle_files_post_start(stdin, stdout, stderr)
 
     def status(self) -> str:
         """Status of the job: eg. running, finished."""
@@ -146,9 +254,18 @@ class Job:
             return 'running'
 
     def wait(self) -> None:
-        """Wait for the process to finish."""
-        if self.proc and self.status != "finished":
+        """Wait for the process and any upstream jobs to finish."""
+        if self.proc and self.status() != "finished":
             self.proc.wait()
+        if self.upstream is not None:
+            self.upstream.wait()
+
+    def close(self) -> None:
+        """Close our ends of the process's pipes."""
+        if self.proc:
+            for file in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+                if file is not None:
+                    file.close()
 
     def get_fds(self) -> tuple[None|IO, None|IO]:
         """Get stdout/stderr if the proc is running."""
@@ -216,6 +333,20 @@ class Job:
         return cast(str, self._read_file(self.proc.stdout,
                                          'read', len, bytes=bytes))
 
+    def records(self):
+        """Lazily parse stdout with self.parse while the process runs.
+
+        If stderr is a VAR too, it's read alongside stdout and kept
+        for var() rather than read with err().
+        """
+        if (not self.proc or not self.proc.stdout or self.stdout != Files.VAR
+                or self.parse is None):
+            return iter(())
+
+        drain = self.proc.stderr if self.stderr == Files.VAR else None
+        chunks = _read_chunks(self.proc.stdout, drain, self._err_chunks)
+        return PARSERS[self.parse](chunks)
+
     def write(self, data: bytes | str) -> None:
         if self.proc and self.proc.stdin and self.stdin == Files.VAR:
             if type(data) == str:
@@ -223,13 +354,17 @@ class Job:
             self.proc.stdin.write(cast(bytes, data))
             self.proc.stdin.flush()
 
-    def var(self) -> str:
+    def var(self) -> 'str | list | tuple | None':
         stdout = stderr = None
-        if self.stdout == Files.VAR:
+        if self.stdout == Files.VAR and self.parse is not None:
+            stdout = list(self.records())
+        elif self.stdout == Files.VAR:
             stdout = self.read()
         if self.stderr == Files.VAR:
-            stderr = self.err()
+            stderr = b''.join(self._err_chunks).decode() + cast(str, self.err())
+            self._err_chunks.clear()
 
+        result: str | list | tuple | None
         if stdout is not None and stderr is not None:
             result = (stdout, stderr)
         elif stdout is not None and stderr is None:
@@ -238,10 +373,78 @@ class Job:
             result = stderr
         else:
             result = None
-        return cast(str, result)
+        return result
+
+class Env(MutableMapping):
+    """Overlay on top of os.environ.
+
+    Only keys set or deleted through the Env are stored. Every other
+    key is read from os.environ as it is at the time, so later changes
+    to os.environ are seen unless the Env has overridden that key.
+    """
+
+    def __init__(self):
+        self._changed: dict[str, str] = {}
+        self._deleted: set[str] = set()
+
+    def __getitem__(self, key: str) -> str:
+        if key in self._changed:
+            return self._changed[key]
+        if key in self._deleted:
+            raise KeyError(key)
+        return os.environ[key]
+
+    def __setitem__(self, key: str, value: str) -> None:
+        self._changed[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self._changed.pop(key, None)
+        self._deleted.add(key)
+
+    def __iter__(self):
+        for key in os.environ:
+            if key not in self._changed and key not in self._deleted:
+                yield key
+        yield from self._changed
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def items(self):
+        # Popen iterates over items(), skip the per key lookups
+        if not self._changed and not self._deleted:
+            return os.environ.items()
+        env = {key: value for key, value in os.environ.items()
+               if key not in self._deleted}
+        env.update(self._changed)
+        return env.items()
+
+    # Keep working for callers that treated Posh.env as a dict
+    def copy(self) -> dict:
+        return dict(self.items())
+
+    def __or__(self, other: Mapping) -> dict:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return self.copy() | dict(other)
+
+    def __ror__(self, other: Mapping) -> dict:
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(other) | self.copy()
+
+    def __ior__(self, other: Mapping) -> 'Env':
+        self.update(other)
+        return self
+
+    def __repr__(self) -> str:
+        return repr(dict(self.items()))
 
 class PATH:
-    def __init__(self, env: dict):
+    def __init__(self, env: MutableMapping):
         self.env = env
 
     def add(self, path: str | Path, mode='append') -> None:
@@ -254,9 +457,11 @@ class PATH:
         else: # prepend
             PATH = f"{path}:" + PATH
 
-        sh.env['PATH'] = PATH
+        self.env['PATH'] = PATH
 
     def remove(self, path: str | Path) -> None:
+        from pathlib import Path
+
         path = Path(path).resolve()
         PATH = self.env.get('PATH', '')
         paths = []
@@ -272,15 +477,17 @@ class PATH:
         return str(self)
 
 class Posh:
-    def __init__(self, cwd: str | None=None, env: dict | None=None):
+    def __init__(self, cwd: str | None=None, env: MutableMapping | None=None):
         """Initialize the shell.
 
         Args:
           cwd: A path to set cwd to.
-          env: Dictionary of environment variables.
+          env: Dictionary of environment variables. Defaults to an
+               Env, which keeps its own changes and reads everything
+               else from os.environ.
         """
         self.cwd = cwd or os.getcwd()
-        self.env = dict(os.environ) if env is None else env
+        self.env = Env() if env is None else env
         self.path = PATH(self.env)
         self.returncode = 0
         self.error = ''
@@ -303,9 +510,13 @@ class Posh:
         self._var_stderr = False
         self._bg = False
         self._shell = self._shell_default
+        self._parse: str | None = None
 
         self._last_job: Job | None = None
 
+        # Background jobs, kept so finished ones get reaped
+        self._bg_jobs: list[Job] = []
+
     def _reset_state(self) -> None:
         self._stdin = self._stdin_default
         self._stdout = self._stdout_default
@@ -317,9 +528,12 @@ class Posh:
         self._var_stderr = False
         self._bg = False
         self._shell = self._shell_default
+        self._parse = None
 
     def _resolve_path(self, path: str | Path) -> Path:
         """Resolve a path relative to the cwd."""
+        from pathlib import Path
+
         path = Path(path)
         if not path.is_absolute():
             path = Path(self.cwd, path)
@@ -410,18 +624,38 @@ class Posh:
             redir_args['stderr'] = Files.NULL
         return self.redir(**redir_args)
 
-    def var(self, *args: list[Files]) -> 'Posh':
+    def var(self, *args: list[Files], parse: str | None=None) -> 'Posh':
         """Buffer stdout/stderr so they can be parsed afterwards.
         
         When the next job completes or pipe ends, instead of
         returning the shell, the stdout/stderr will be returned
         instead. By default, only stdout is returned.
 
+        If parse is given, stdout is parsed into a list of records
+        while the process runs instead of being returned as one
+        string. A backgrounded job's Job.records() gives a lazy
+        iterator instead. A VAR stderr is read alongside stdout so
+        neither pipe can fill up and block the process.
+            lines = str per line, without the line ending
+           split0 = str per NUL-delimited entry, eg. find -print0
+            jsonl = one decoded JSON value per non-blank line
+              csv = list of fields per row
+              tsv = csv, but tab-delimited
+
         Args:
             *args: STDOUT and/or STDERR
+            parse: One of - lines/split0/jsonl/csv/tsv
         """
+        stdout = Files.STDOUT in args or not args
+        if parse is not None:
+            if parse not in PARSERS:
+                raise PoshError(f"{parse} is not a valid parse mode")
+            if not stdout and self._stdout != Files.VAR:
+                raise PoshError("parse needs stdout to be a VAR")
+            self._parse = parse
+
         redir_args = {}
-        if Files.STDOUT in args or not args:
+        if stdout:
             redir_args['stdout'] = Files.VAR
         if Files.STDERR in args:
             redir_args['stderr'] = Files.VAR
@@ -448,7 +682,7 @@ class Posh:
 
         return self
 
-    def end(self) -> 'Posh | str | Job':
+    def end(self) -> 'Posh | str | list | tuple | Job':
         """Signal the end of a pipe."""
         job = self._last_job
 
@@ -460,6 +694,7 @@ class Posh:
 
         job.stdout = self._stdout
         job.stderr = self._stderr
+        job.parse = self._parse
                     
         return self._execute(job)
 
@@ -472,6 +707,9 @@ class Posh:
         return self
 
     def __getattr__(self, name: str | Path) -> Callable:
+        import shutil
+        from pathlib import Path
+
         path = shutil.which(name, path=self.env.get("PATH"))
         if not path:
             if Path(name).is_absolute():
@@ -504,7 +742,7 @@ class Posh:
     def __call__(self, cmd, *args):
         return self._run(cmd, *args)
 
-    def _run(self, path: str, *args: list, **kwargs: dict) -> 'Posh | str | Job':
+    def _run(self, path: str, *args: list, **kwargs: dict) -> 'Posh | str | list | tuple | Job':
         #TODO catch errors
         string_args = []
         for param in args:
@@ -517,13 +755,27 @@ class Posh:
         job.stdin = self._stdin
         job.stdout = self._stdout
         job.stderr = self._stderr
+        job.parse = self._parse
 
         if self._pipe_stdout or self._pipe_stderr:
             self._execute_pipe(job)
             return self
         return self._execute(job)
 
-    def _execute(self, job: Job) -> 'Posh | str | Job':
+    def _reap_bg_jobs(self) -> None:
+        """Forget finished background jobs. Polling them reaps zombies."""
+        running = []
+        for bg_job in self._bg_jobs:
+            job: Job | None = bg_job
+            while job is not None:
+                if job.status() != 'finished':
+                    running.append(bg_job)
+                    break
+                job = job.upstream
+        self._bg_jobs = running
+
+    def _execute(self, job: Job) -> 'Posh | str | list | tuple | Job':
+        self._reap_bg_jobs()
         job.start()
         
         # We need to reset state, including _bg, before we leave this function.
@@ -533,18 +785,33 @@ class Posh:
         self._reset_state()
 
         if bg:
+            self._bg_jobs.append(job)
             return job
-        job.wait()
-        self.returncode = job.proc.returncode # type: ignore
 
-        self._last_job = job
+        # Parsed output is consumed as it arrives, so read before waiting.
+        # If parsing fails, closing our ends of the pipes lets the process
+        # die of EPIPE instead of blocking on a full pipe, then reap it.
+        try:
+            if job.parse is not None:
+                var = job.var()
+                job.wait()
+            else:
+                job.wait()
+                var = job.var()
+        finally:
+            job.close()
+            job.wait()
+            self.returncode = job.proc.returncode # type: ignore
+
+            self._last_job = job
 
-        var = job.var()
         result = self if var is None else var
         return result
 
 
     def _execute_pipe(self, job: Job) -> None:
+        import subprocess
+
         last_job = self._last_job
         if last_job:
             last_job.start()
@@ -556,6 +823,7 @@ class Posh:
             elif self._pipe_stderr:
                 if stderr is not None:
                     job.stdin = stderr
+            job.upstream = last_job
 
         if self._pipe_stdout and not self._pipe_stderr:
             job.stdout = subprocess.PIPE
@@ -567,4 +835,10 @@ class Posh:
 
         self._last_job = job
 
-sh = Posh()
+def __getattr__(name: str) -> Posh:
+    """Create the global shell the first time it is used."""
+    global sh
+    if name == 'sh':
+        sh = Posh()
+        return sh
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,146 @@
+#!/bin/python3
+"""Stress posh and check that fds, children, threads and RSS stay flat.
+
+Runs a mix of plain commands, file redirections, var(), pipe() and bg()
+jobs, then compares resource counts against a baseline taken after a
+warmup. Reports throughput and p50/p99 latency per operation.
+
+The most recent results, bg jobs included, are kept referenced the way a
+long running program might, so CPython's garbage collection can't close
+leaked pipes or reap children behind posh's back. Any ResourceWarning
+(unclosed file, subprocess still running) seen under load fails the run.
+
+    python3 stress.py [--iterations N]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import warnings
+from collections import deque
+from pathlib import Path
+from posh.posh import Posh
+
+def open_fds() -> int:
+    return len(os.listdir('/proc/self/fd'))
+
+def children() -> tuple[int, int]:
+    """Count (children, zombies) of this process."""
+    pid = str(os.getpid())
+    count = zombies = 0
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            stat = Path('/proc', entry, 'stat').read_text()
+        except OSError:
+            continue
+        # The comm field can contain spaces, so split after it
+        fields = stat.rsplit(')', 1)[1].split()
+        if fields[1] == pid:
+            count += 1
+            if fields[0] == 'Z':
+                zombies += 1
+    return count, zombies
+
+def threads() -> int:
+    for line in Path('/proc/self/status').read_text().splitlines():
+        if line.startswith('Threads:'):
+            return int(line.split()[1])
+    return 0
+
+def rss_kb() -> int:
+    pages = int(Path('/proc/self/statm').read_text().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+
+def snapshot(sh: Posh) -> dict:
+    # Let bg jobs finish, then run a command so posh reaps them itself
+    time.sleep(0.2)
+    sh.true()
+    count, zombies = children()
+    return {'fds': open_fds(),
+            'children': count,
+            'zombies': zombies,
+            'threads': threads(),
+            'rss_kb': rss_kb()}
+
+def operations(sh: Posh, tmp: Path) -> dict:
+    afile = tmp / 'afile'
+    return {
+        'execute': lambda: sh.true(),
+        'redir': lambda: sh.redir(stdout=afile).echo('hi'),
+        'var': lambda: sh.var().echo('hi'),
+        'parse': lambda: sh.var(parse='lines').seq(10),
+        'pipe': lambda: sh.var().pipe().echo('hi').cat().end(),
+        'bg': lambda: sh.bg().true(),
+        'bg_pipe': lambda: sh.null().bg().pipe().echo('hi').cat().end(),
+    }
+
+def percentile(samples: list[float], pct: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def run(sh: Posh, ops: dict, iterations: int, kept: deque) -> dict:
+    latencies: dict[str, list[float]] = {name: [] for name in ops}
+    names = list(ops)
+    for i in range(iterations):
+        name = names[i % len(names)]
+        start = time.perf_counter()
+        kept.append(ops[name]())
+        latencies[name].append(time.perf_counter() - start)
+    return latencies
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--rss-slack-kb', type=int, default=8192,
+                        help='allowed RSS growth')
+    parser.add_argument('--keep', type=int, default=1000,
+                        help='number of recent results kept referenced')
+    args = parser.parse_args()
+
+    kept: deque = deque(maxlen=args.keep)
+    with tempfile.TemporaryDirectory() as tmp, \
+            warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', ResourceWarning)
+        sh = Posh(cwd=tmp)
+        ops = operations(sh, Path(tmp))
+
+        run(sh, ops, 500, kept)
+        before = snapshot(sh)
+
+        start = time.perf_counter()
+        latencies = run(sh, ops, args.iterations, kept)
+        elapsed = time.perf_counter() - start
+
+        after = snapshot(sh)
+    resource_warnings = [w for w in caught
+                         if issubclass(w.category, ResourceWarning)]
+
+    print(f"{args.iterations} ops in {elapsed:.2f}s "
+          f"({args.iterations / elapsed:.0f} ops/s)")
+    for name, samples in latencies.items():
+        print(f"  {name:10} p50 {percentile(samples, 50) * 1000:7.2f}ms"
+              f"  p99 {percentile(samples, 99) * 1000:7.2f}ms")
+
+    failed = False
+    for key in before:
+        print(f"  {key:10} {before[key]:8} -> {after[key]}")
+        slack = args.rss_slack_kb if key == 'rss_kb' else 0
+        if after[key] > before[key] + slack:
+            failed = True
+    print(f"  {'warnings':10} {len(resource_warnings):8} ResourceWarnings")
+    if resource_warnings:
+        print(f"  eg. {resource_warnings[0].message}")
+        failed = True
+    if after['zombies']:
+        failed = True
+    if failed:
+        print("FAIL: resources leaked under load")
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())